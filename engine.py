@@ -1,3 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 from loguru import logger
 
@@ -8,6 +11,19 @@ class RateioEngine:
     baseado em métricas específicas e critérios de alocação.
     """
 
+    # Centros de resultado rateados em cada etapa
+    STAGE_CENTERS = {
+        1: [100, 204],
+        2: [268, 288]
+    }
+
+    # Colunas auxiliares com o mês de cada coluna de data, opcionais nos DataFrames
+    # de entrada e removidas dos resultados
+    MONTH_COLUMNS = {
+        'dt_competencia': 'mo_competencia',
+        'dt_referencia': 'mo_referencia'
+    }
+
     def __init__(self, df_lancamentos, df_metricas):
         """
         Inicializa o motor de rateio com os dataframes necessários.
@@ -15,10 +31,77 @@ class RateioEngine:
         Args:
             df_lancamentos: DataFrame com os lançamentos financeiros a serem rateados
             df_metricas: DataFrame com as métricas que serão base para o rateio
+            
+        As colunas de mês de MONTH_COLUMNS ('mo_competencia', 'mo_referencia') são
+        usadas nos filtros de período quando presentes; caso contrário, o mês é obtido
+        da coluna de data correspondente.
         """
         self.df_lancamentos = df_lancamentos
         self.df_metricas = df_metricas
 
+        # Etapa de rateio de cada lançamento, usada para particionar os registros
+        self._lanc_stage = self.__label_stages(df_lancamentos['id_centro_resultado'].to_numpy())
+
+        # Ratios de alocação das duas etapas, calculados sob demanda
+        self._allocation_ratios = None
+
+    def __label_stages(self, centers):
+        """
+        Classifica cada centro de resultado na etapa de rateio correspondente.
+        
+        Quando os centros estão ordenados, cada centro ocupa um intervalo contíguo e
+        as etapas são atribuídas por fatias localizadas com busca binária.
+        
+        Args:
+            centers: Array com os ids de centro de resultado
+            
+        Returns:
+            Array com a etapa de rateio de cada registro (0 para centros não rateados)
+        """
+        if len(centers) and np.all(centers[:-1] <= centers[1:]):
+            labels = np.zeros(len(centers), dtype=np.int64)
+            for stage, stage_centers in self.STAGE_CENTERS.items():
+                starts = np.searchsorted(centers, stage_centers, side='left')
+                stops = np.searchsorted(centers, stage_centers, side='right')
+                for start, stop in zip(starts, stops):
+                    labels[start:stop] = stage
+            return labels
+
+        return np.select(
+            [np.isin(centers, np.array(self.STAGE_CENTERS[stage], dtype=np.int32)) for stage in (1, 2)],
+            [1, 2],
+            default=0
+        )
+
+    def __month_values(self, df, date_column):
+        """
+        Retorna o mês de cada linha do DataFrame para a coluna de data informada.
+        
+        Args:
+            df: DataFrame com a coluna de data
+            date_column: Nome da coluna de data
+            
+        Returns:
+            Array com o mês de cada linha, lido da coluna auxiliar de mês quando presente
+        """
+        month_column = self.MONTH_COLUMNS[date_column]
+        if month_column in df.columns:
+            return df[month_column].to_numpy()
+        return df[date_column].dt.month.to_numpy()
+
+    def __drop_month_columns(self, df):
+        """
+        Remove as colunas auxiliares de mês do DataFrame, se existirem.
+        
+        Args:
+            df: DataFrame de registros
+            
+        Returns:
+            DataFrame sem as colunas de MONTH_COLUMNS
+        """
+        month_columns = [col for col in self.MONTH_COLUMNS.values() if col in df.columns]
+        return df.drop(columns=month_columns) if month_columns else df
+
     def __filter_by_period_and_criteria(self, df, date_column, months, **criteria):
         """
         Filtra DataFrame por período (meses) e critérios adicionais.
@@ -32,10 +115,11 @@ class RateioEngine:
         Returns:
             DataFrame filtrado
         """
-        mask = df[date_column].dt.month.isin(months)
+        mask = np.isin(self.__month_values(df, date_column), months)
+        # Series.isin compara os códigos das colunas category, sem materializar os valores
         for column, values in criteria.items():
-            mask &= df[column].isin(values)
-        return df[mask].copy()
+            mask &= df[column].isin(values).to_numpy()
+        return df.loc[mask]
 
     def __calculate_allocation_ratios(self, df, group_columns, value_column='total'):
         """
@@ -49,11 +133,68 @@ class RateioEngine:
         Returns:
             DataFrame com os ratios de alocação por grupo
         """
-        totals = df.groupby(group_columns)[value_column].sum().reset_index()
-        total_metric_value = totals['total'].sum()
-        totals['allocation_ratio'] = totals['total'] / total_metric_value if total_metric_value > 0 else 0
+        # Fatoriza as chaves (ordenadas, como no groupby) e combina em um único código por grupo
+        factorized = [pd.factorize(df[col], sort=True) for col in group_columns]
+        shape = tuple(len(uniques) for _, uniques in factorized)
+        key_codes = [codes for codes, _ in factorized]
+        valid = np.logical_and.reduce([codes >= 0 for codes in key_codes])
+        group_codes = np.ravel_multi_index([codes[valid] for codes in key_codes], shape)
+
+        # Valores nulos não entram na soma, como no groupby; o grupo continua presente
+        values = df[value_column].to_numpy(dtype=np.float64)[valid]
+        values = np.where(np.isnan(values), 0.0, values)
+
+        # Soma por grupo em uma única passada, mantendo apenas os grupos presentes
+        n_groups = int(np.prod(shape))
+        sums = np.bincount(group_codes, weights=values, minlength=n_groups)
+        present = np.flatnonzero(np.bincount(group_codes, minlength=n_groups))
+
+        # Dimensões voltam como object, mantendo o schema dos resultados mesmo com
+        # colunas category na entrada
+        totals = pd.DataFrame({
+            col: np.asarray(uniques, dtype=object).take(codes)
+            for col, (_, uniques), codes in zip(group_columns, factorized, np.unravel_index(present, shape))
+        })
+        totals[value_column] = sums[present]
+
+        total_metric_value = totals[value_column].sum()
+        totals['allocation_ratio'] = totals[value_column] / total_metric_value if total_metric_value > 0 else 0
         return totals
     
+    def __get_allocation_ratios(self, stage):
+        """
+        Retorna os ratios de alocação da etapa informada.
+        
+        As métricas são filtradas uma única vez (período e metrica_2) e os ratios das
+        duas etapas são derivados do mesmo DataFrame filtrado.
+        
+        Args:
+            stage: Número da etapa de rateio
+            
+        Returns:
+            DataFrame com os ratios de alocação da etapa
+        """
+        if self._allocation_ratios is None:
+            metricas_filtered = self.__filter_by_period_and_criteria(
+                self.df_metricas,
+                'dt_referencia', [10, 11],
+                ds_metrica=['metrica_2']
+            )
+            canal_mask = metricas_filtered['ds_canal_aquisicao'].isin(['canalA', 'canalB']).to_numpy()
+
+            self._allocation_ratios = {
+                1: self.__calculate_allocation_ratios(
+                    metricas_filtered.loc[canal_mask],
+                    ['ds_canal_aquisicao', 'ds_segmento']
+                ),
+                2: self.__calculate_allocation_ratios(
+                    metricas_filtered,
+                    ['ds_segmento']
+                )
+            }
+
+        return self._allocation_ratios[stage]
+    
     def __create_allocation_records(self, lancamentos_df, allocation_df, value_column, ratio_column, stage):
         """
         Cria registros de alocação para cada combinação lançamento/alocação.
@@ -68,28 +209,24 @@ class RateioEngine:
         Returns:
             DataFrame com todos os registros alocados
         """
-        results = []
-        for _, lancamento in lancamentos_df.iterrows():
-            for _, row in allocation_df.iterrows():
-                allocated_value = lancamento[value_column] * row[ratio_column]
-                
-                # Criar registro base com todas as colunas do lançamento
-                record = lancamento.to_dict()
-                
-                # Adicionar/sobrescrever campos específicos de alocação
-                record.update({
-                    'valor_rateado': allocated_value,
-                    'etapa_rateio': stage
-                })
-                
-                # Adicionar campos do ratio se existirem
-                for col in allocation_df.columns:
-                    if col not in ['total', ratio_column]:
-                        record[col] = row[col]
-                
-                results.append(record)
-        
-        return pd.DataFrame(results)
+        allocation_columns = [col for col in allocation_df.columns if col not in ['total', ratio_column]]
+
+        # Índices do produto cartesiano: cada lançamento repetido para cada alocação
+        n_lancamentos, n_allocations = len(lancamentos_df), len(allocation_df)
+        lancamento_idx = np.repeat(np.arange(n_lancamentos), n_allocations)
+        allocation_idx = np.tile(np.arange(n_allocations), n_lancamentos)
+
+        # Monta as colunas diretamente; campos do ratio sobrescrevem os do lançamento
+        columns = {col: lancamentos_df[col].array.take(lancamento_idx) for col in lancamentos_df.columns}
+        columns['valor_rateado'] = np.outer(
+            lancamentos_df[value_column].to_numpy(),
+            allocation_df[ratio_column].to_numpy()
+        ).ravel()
+        columns['etapa_rateio'] = np.full(n_lancamentos * n_allocations, stage)
+        for col in allocation_columns:
+            columns[col] = allocation_df[col].array.take(allocation_idx)
+
+        return pd.DataFrame(columns)
 
     def process_first_stage(self):
         """
@@ -99,49 +236,43 @@ class RateioEngine:
         Returns:
             DataFrame com os registros após o primeiro estágio de rateio
         """
-        # Filtra dados relevantes para o primeiro rateio
-        metricas_filtered = self.__filter_by_period_and_criteria(
-            self.df_metricas,
-            'dt_referencia', [10, 11],
-            ds_metrica=['metrica_2'],
-            ds_canal_aquisicao=['canalA', 'canalB']
-        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Obtém ratios de alocação por canal e segmento em paralelo com o filtro dos lançamentos
+            ratios_future = executor.submit(self.__get_allocation_ratios, 1)
 
-        centers_filtered = self.__filter_by_period_and_criteria(
-            self.df_lancamentos,
-            'dt_competencia', [10, 11],
-            id_centro_resultado=[100, 204]
-        )
+            # Filtra dados relevantes para o primeiro rateio
+            is_stage1 = self._lanc_stage == 1
+            centers_filtered = self.df_lancamentos.loc[is_stage1 & np.isin(self.__month_values(self.df_lancamentos, 'dt_competencia'), [10, 11])]
 
-        # Calcula ratios de alocação
-        allocation_ratios = self.__calculate_allocation_ratios(
-            metricas_filtered, 
-            ['ds_canal_aquisicao', 'ds_segmento']
-        )
+            # Criar registros alocados em paralelo com a obtenção dos não alocados
+            allocated_future = executor.submit(
+                self.__create_allocation_records,
+                centers_filtered,
+                ratios_future.result(),
+                'valor',
+                'allocation_ratio',
+                1
+            )
 
-        # Criar registros alocados
-        allocated_records = self.__create_allocation_records(
-            centers_filtered,
-            allocation_ratios,
-            'valor',
-            'allocation_ratio',
-            1
-        )
+            # Obter registros não alocados nesta etapa, montando as colunas de uma só vez
+            non_allocated_lanc = self.df_lancamentos.loc[~is_stage1]
+            n_non_allocated = len(non_allocated_lanc)
+            non_allocated = pd.DataFrame({
+                **{col: non_allocated_lanc[col].array for col in non_allocated_lanc.columns},
+                'valor_rateado': non_allocated_lanc['valor'].to_numpy(),
+                'ds_canal_aquisicao': np.full(n_non_allocated, None, dtype=object),
+                'ds_segmento': np.full(n_non_allocated, None, dtype=object),
+                'etapa_rateio': np.zeros(n_non_allocated, dtype=np.int64)
+            })
 
-        # Obter registros não alocados nesta etapa
-        non_allocated = self.df_lancamentos[
-            ~self.df_lancamentos['id_centro_resultado'].isin([100, 204])
-        ].assign(
-            valor_rateado=lambda x: x['valor'],
-            ds_canal_aquisicao=None,
-            ds_segmento=None,
-            etapa_rateio=0
-        )
+            allocated_records = allocated_future.result()
 
         # Combinar resultados alocados e não alocados
-        stage1_df = pd.concat([allocated_records, non_allocated], ignore_index=True)
+        stage1_df = self.__drop_month_columns(
+            pd.concat([allocated_records, non_allocated], ignore_index=True)
+        )
         
-        logger.success(f"Primeiro estágio concluído: {len(stage1_df)} registros")
+        logger.success("Primeiro estágio concluído: {} registros", len(stage1_df))
         
         return stage1_df
     
@@ -156,46 +287,44 @@ class RateioEngine:
         Returns:
             DataFrame com os registros após o segundo estágio de rateio
         """
-        # Filtra dados relevantes para o segundo rateio
-        metricas_filtered = self.__filter_by_period_and_criteria(
-            self.df_metricas,
-            'dt_referencia', [10, 11],
-            ds_metrica=['metrica_2']   
-        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Obtém ratios de alocação por segmento em paralelo com a partição dos registros
+            ratios_future = executor.submit(self.__get_allocation_ratios, 2)
 
-        centers_filtered = self.__filter_by_period_and_criteria(
-            stage1_df,
-            'dt_competencia', [10, 11],
-            id_centro_resultado=[268, 288]
-        )
+            # Particiona os registros do primeiro estágio em uma única classificação
+            stage1_etapa = stage1_df['etapa_rateio'].to_numpy()
+            is_stage2 = self.__label_stages(stage1_df['id_centro_resultado'].to_numpy()) == 2
 
-        # Calcula ratios de alocação por segmento
-        allocation_ratios = self.__calculate_allocation_ratios(
-            metricas_filtered, 
-            ['ds_segmento']
-        )
+            # Filtra dados relevantes para o segundo rateio; o mês é obtido apenas
+            # para os registros dos centros da segunda etapa
+            stage2_candidates = stage1_df.loc[is_stage2]
+            centers_filtered = stage2_candidates.loc[
+                np.isin(self.__month_values(stage2_candidates, 'dt_competencia'), [10, 11])
+            ]
 
-        # Criar registros alocados
-        allocated_records = self.__create_allocation_records(
-            centers_filtered,
-            allocation_ratios,
-            'valor',
-            'allocation_ratio',
-            2
-        )
+            # Criar registros alocados em paralelo com a obtenção dos demais registros
+            allocated_future = executor.submit(
+                self.__create_allocation_records,
+                centers_filtered,
+                ratios_future.result(),
+                'valor',
+                'allocation_ratio',
+                2
+            )
+
+            # Obter registros já alocados no primeiro estágio
+            already_allocated = stage1_df.loc[stage1_etapa == 1]
 
-        # Obter registros já alocados no primeiro estágio
-        already_allocated = stage1_df[stage1_df['etapa_rateio'] == 1]
+            # Obter registros não alocados nesta etapa
+            non_allocated_stage2 = stage1_df.loc[(stage1_etapa == 0) & ~is_stage2]
 
-        # Obter registros não alocados nesta etapa
-        non_allocated_stage2 = stage1_df[
-            (stage1_df['etapa_rateio'] == 0) & 
-            (~stage1_df['id_centro_resultado'].isin([268, 288]))
-        ]
+            allocated_records = allocated_future.result()
         
         # Combinar todos os registros
-        combined_df = pd.concat([already_allocated, allocated_records, non_allocated_stage2], ignore_index=True)
+        combined_df = self.__drop_month_columns(
+            pd.concat([already_allocated, allocated_records, non_allocated_stage2], ignore_index=True)
+        )
         
-        logger.success(f"Segundo estágio concluído: {len(combined_df)} registros")
+        logger.success("Segundo estágio concluído: {} registros", len(combined_df))
         
         return combined_df
\ No newline at end of file
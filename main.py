@@ -9,16 +9,24 @@ from utils import (
     convert_to_datetime,
     get_connection,
     truncate_table,
-    insert_data
+    insert_data,
+    write_parquet
 )
 
+# Filtros aplicados na leitura dos arquivos brutos, no formato coluna=valores.
+# Apenas a métrica utilizada pelo rateio é carregada; os lançamentos são mantidos
+# integralmente pois os não rateados também compõem o resultado.
+LOAD_FILTERS = {
+    "metricas": {"ds_metrica": ["metrica_2"]},
+}
+
 def load_json_data():
     """
     Esta função carrega os dados do diretório de dados brutos e os converte em DataFrames.
     
     Processo:
-    1. Lê todos os arquivos JSON do diretório de dados brutos
-    2. Converte cada arquivo JSON em um DataFrame
+    1. Lê os arquivos JSON do diretório de dados brutos, um por vez
+    2. Converte cada arquivo JSON em um DataFrame, aplicando os filtros de LOAD_FILTERS
     3. Armazena os DataFrames em um dicionário usando o nome do arquivo (sem extensão) como chave
     
     Returns:
@@ -32,14 +40,15 @@ def load_json_data():
 
     for file_name, data in results:
         key = os.path.splitext(file_name)[0]
-        df_dict[key] = convert_to_df(data)
+        df_dict[key] = convert_to_df(data, LOAD_FILTERS.get(key))
 
     return df_dict
 
 def prepare_dataframes(df_lancamentos, df_metricas):
     """
     Prepara e padroniza os DataFrames para processamento, convertendo colunas de datas 
-    para o formato datetime.
+    para o formato datetime, criando as colunas de mês, convertendo o centro de
+    resultado para int32 e as dimensões das métricas para category.
     Parameters:
     -----------
     df_lancamentos : pandas.DataFrame
@@ -51,7 +60,11 @@ def prepare_dataframes(df_lancamentos, df_metricas):
     --------
     tuple
         Uma tupla contendo (df_lancamentos, df_metricas) com as colunas de data
-        devidamente convertidas para o formato datetime.
+        devidamente convertidas para o formato datetime, as colunas de mês
+        'mo_competencia' e 'mo_referencia' (int8, 0 para datas ausentes) e
+        'id_centro_resultado' em int32, com os lançamentos ordenados por centro de
+        resultado. Em df_metricas, 'ds_canal_aquisicao',
+        'ds_segmento' e 'ds_metrica' passam a ser do tipo category.
     Notes:
     ------
     A função utiliza a função auxiliar 'convert_to_datetime' para realizar as conversões
@@ -65,6 +78,16 @@ def prepare_dataframes(df_lancamentos, df_metricas):
     for df, columns in date_columns_list:
         for column in columns:
             df[column] = convert_to_datetime(df, column)
+            if column in RateioEngine.MONTH_COLUMNS:
+                df[RateioEngine.MONTH_COLUMNS[column]] = df[column].dt.month.fillna(0).astype('int8')
+
+    df_lancamentos['id_centro_resultado'] = df_lancamentos['id_centro_resultado'].astype('int32')
+
+    # Ordena por centro de resultado para que cada centro ocupe um intervalo contíguo
+    df_lancamentos = df_lancamentos.sort_values('id_centro_resultado', kind='mergesort').reset_index(drop=True)
+
+    for column in ['ds_canal_aquisicao', 'ds_segmento', 'ds_metrica']:
+        df_metricas[column] = df_metricas[column].astype('category')
     
     return df_lancamentos, df_metricas
 
@@ -93,12 +116,14 @@ def main():
     truncate_table(conn, "tb_rateio_2")
 
     # OBS.: Manter comentado caso não tenha acesso ao banco de dados
-    insert_data(conn, "tb_rateio_1", stage1_df)
-    insert_data(conn, "tb_rateio_2", stage2_df)
+    # As duas inserções são confirmadas em uma única transação
+    insert_data(conn, "tb_rateio_1", stage1_df, commit=False)
+    insert_data(conn, "tb_rateio_2", stage2_df, commit=False)
+    conn.commit()
 
     # Salvar resultados
-    stage1_df.to_parquet("data/processed/rateio_etapa1.parquet")
-    stage2_df.to_parquet("data/processed/rateio_etapa2.parquet")
+    write_parquet(stage1_df, "data/processed/rateio_etapa1.parquet")
+    write_parquet(stage2_df, "data/processed/rateio_etapa2.parquet")
 
     logger.success("Processamento de dados completo")
 
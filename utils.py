@@ -1,11 +1,32 @@
-import json 
+import mmap
 import os
-import arrow
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import mysql.connector
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pajson
+import pyarrow.parquet as pq
 
 from loguru import logger
 
+# Parser JSON mais rápido disponível; todos aceitam bytes em loads()
+try:
+    import orjson as _json
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
+
+# Arquivos a partir deste tamanho (bytes) são mapeados em memória na leitura
+MMAP_MIN_SIZE = 1 << 20
+
+# Extensões de arquivos JSON-lines (um registro JSON por linha)
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
 
 def get_connection():
     """
@@ -25,7 +46,7 @@ def get_connection():
         return conn
     
     except mysql.connector.Error as e:
-        logger.error(f"Erro ao conectar ao banco de dados: {e}")   
+        logger.error("Erro ao conectar ao banco de dados: {}", e)   
 
 
 def execute_query(conn, query):
@@ -61,18 +82,21 @@ def truncate_table(conn, table):
     """
     return execute_query(conn, query)
 
-def insert_data(conn, table, df):
+def insert_data(conn, table, df, commit=True):
     """
     Insere dados de um DataFrame em uma tabela do banco de dados.
     
     Esta função processa o DataFrame e insere seus dados na tabela especificada,
     usando inserção em lotes para melhor performance. Trata valores nulos
-    e fornece feedback sobre o número de registros inseridos.
+    e fornece feedback sobre o número de registros inseridos. Todos os lotes
+    são gravados em uma única transação.
     
     Args:
         conn: Conexão com o banco de dados.
         table (str): Nome da tabela onde os dados serão inseridos.
         df (pd.DataFrame): DataFrame contendo os dados a serem inseridos.
+        commit (bool): Se True, confirma a transação ao final da inserção. Use False
+                       para agrupar várias inserções e confirmar com conn.commit().
         
     Returns:
         None: A função não retorna valores, mas registra o resultado da operação.
@@ -87,18 +111,10 @@ def insert_data(conn, table, df):
     """
 
     # Converter dados do DataFrame para lista de valores, tratando valores nulos
-    values = []
-    for row in df.itertuples(index=False):
-        row_values = []
-        for val in row:
-            if pd.isna(val):
-                row_values.append(None)
-            else:
-                row_values.append(val)
-        values.append(row_values)
+    values = df.astype(object).where(pd.notna(df), None).to_numpy().tolist()
 
     # Definir tamanho do lote para inserção em massa
-    batch_size = 1000
+    batch_size = 5000
     total_inserted = 0
     
     # Inserir dados em lotes para melhor performance
@@ -106,43 +122,109 @@ def insert_data(conn, table, df):
         batch = values[i:i+batch_size]
         cursor.executemany(query, batch)
         total_inserted += cursor.rowcount
+
+    # Confirma todos os lotes de uma só vez
+    if commit:
         conn.commit()
     
-    logger.success(f"{total_inserted} registros inseridos na tabela {table}")
+    logger.success("{} registros inseridos na tabela {}", total_inserted, table)
 
 
 
+def write_parquet(df, file_path, dictionary_columns=('ds_canal_aquisicao', 'ds_segmento', 'ds_metrica')):
+    """
+    Grava um DataFrame em um arquivo Parquet.
+    
+    Usa compressão zstd, grupos de linhas de 256 mil registros e estatísticas por
+    coluna, permitindo filtros por predicado na leitura. As colunas de baixa
+    cardinalidade são gravadas com codificação por dicionário.
+    
+    Args:
+        df (pd.DataFrame): DataFrame a ser gravado.
+        file_path (str): Caminho do arquivo Parquet de destino.
+        dictionary_columns (tuple): Colunas gravadas com codificação por dicionário,
+                                    consideradas apenas quando presentes no DataFrame.
+        
+    Returns:
+        None
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(
+        table,
+        file_path,
+        compression='zstd',
+        compression_level=3,
+        row_group_size=256_000,
+        use_dictionary=[col for col in dictionary_columns if col in table.column_names],
+        write_statistics=True
+    )
+    logger.success("{} registros gravados em {}", len(df), file_path)
+
 
 def read_json_file(file_path):
     """
     Lê e analisa um arquivo JSON.
     Esta função tenta ler e analisar o arquivo JSON no caminho especificado.
+    Com orjson, arquivos a partir de MMAP_MIN_SIZE bytes são mapeados em memória e
+    analisados diretamente, sem cópia do conteúdo para um buffer intermediário.
+    Arquivos JSON-lines (JSON_LINES_EXTENSIONS) são lidos diretamente como tabela Arrow.
     Registra quaisquer erros encontrados durante o processo.
     Args:
         file_path (str): Caminho para o arquivo JSON a ser lido.
     Returns:
-        dict ou list: Dados JSON analisados se for bem-sucedido, None caso contrário.
+        dict, list ou pa.Table: Dados JSON analisados se for bem-sucedido, None caso contrário.
     Raises:
         FileNotFoundError: Registra erro se o arquivo não for encontrado.
-        json.JSONDecodeError: Registra erro se o arquivo não for um JSON válido.
+        ValueError: Registra erro se o arquivo não for um JSON válido.
     """
     try:
-        with open(file_path) as f:
-            data = json.load(f) 
+        if file_path.endswith(JSON_LINES_EXTENSIONS):
+            return read_json_table(file_path)
+
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= MMAP_MIN_SIZE and _json.__name__ == 'orjson':
+                # orjson aceita o buffer do mapeamento diretamente
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buffer:
+                    data = _json.loads(buffer)
+            else:
+                data = _json.loads(f.read())
             return data
         
     except FileNotFoundError:
-        logger.error(f"Arquivo não encontrado: {file_path}");
-    except json.JSONDecodeError:
-        logger.error(f"Arquivo JSON inválido: {file_path}");
+        logger.error("Arquivo não encontrado: {}", file_path);
+    except ValueError:
+        # Erros de decodificação de orjson, ujson, json e pyarrow derivam de ValueError
+        logger.error("Arquivo JSON inválido: {}", file_path);
 
 
-def list_files_directory(directory_path):
+def read_json_table(file_path, block_size=16 << 20):
+    """
+    Lê um arquivo JSON-lines diretamente como tabela Arrow.
+    
+    A leitura e a análise são feitas pelo leitor JSON do pyarrow, em blocos
+    processados em paralelo, montando as colunas sem passar por objetos Python.
+    
+    Args:
+        file_path (str): Caminho para o arquivo JSON-lines a ser lido.
+        block_size (int): Tamanho, em bytes, dos blocos analisados em paralelo.
+    
+    Returns:
+        pa.Table: Tabela com um registro por linha do arquivo.
+    """
+    return pajson.read_json(file_path, read_options=pajson.ReadOptions(block_size=block_size))
+
+
+def list_files_directory(directory_path, suffix=None):
     """
     Lista todos os arquivos em um diretório especificado.
     
     Args:
         directory_path (str): Caminho para o diretório a ser listado.
+        suffix (str ou tuple, optional): Extensão (ou extensões) dos arquivos a serem
+                                         listados. Entradas com outras extensões são
+                                         descartadas pelo nome, antes de qualquer
+                                         verificação de tipo.
         
     Returns:
         list: Lista com os caminhos completos de todos os arquivos no diretório.
@@ -151,58 +233,69 @@ def list_files_directory(directory_path):
         FileNotFoundError: Registra erro se o diretório não for encontrado.
     """
     try:
-        # Verifica se o caminho é um diretório válido
-        if not os.path.isdir(directory_path):
-            raise FileNotFoundError 
+        # Percorre o diretório usando o tipo de entrada retornado pelo próprio scandir,
+        # adicionando à lista apenas arquivos (não diretórios) com a extensão desejada
+        with os.scandir(directory_path) as entries:
+            return [
+                entry.path for entry in entries
+                if (suffix is None or entry.name.endswith(suffix)) and entry.is_file()
+            ]
     
-        paths = []
-        # Percorre todos os elementos no diretório
-        for file_name in os.listdir(directory_path):
-            full_path = os.path.join(directory_path, file_name)
-            # Adiciona à lista apenas se for um arquivo (não diretório)
-            if os.path.isfile(full_path):
-                paths.append(full_path)
-        return paths
-    
-    except FileNotFoundError:
-        logger.error(f"Diretório não encontrado: {directory_path}");
+    except (FileNotFoundError, NotADirectoryError):
+        logger.error("Diretório não encontrado: {}", directory_path);
 
 
 def read_raw_files(directory_path="data/raw"):
     """
-    Lê todos os arquivos JSON brutos de um diretório especificado.
+    Lê todos os arquivos JSON e JSON-lines brutos de um diretório especificado.
+    
+    Os arquivos são lidos em paralelo por um pool de threads e fornecidos sob demanda,
+    na ordem do diretório. No máximo um arquivo por thread é lido à frente do consumo,
+    limitando o uso de memória. Use list(read_raw_files(...)) caso seja necessária
+    uma lista.
     
     Args:
         directory_path (str): Caminho para o diretório contendo os arquivos brutos.
                              O valor padrão é "data/raw".
     
-    Returns:
-        list: Lista de tuplas contendo (nome_arquivo, dados) para cada arquivo JSON processado com sucesso.
+    Yields:
+        tuple: Tupla contendo (nome_arquivo, dados) para cada arquivo JSON processado com sucesso.
     """
-    # Obtém a lista de caminhos de arquivos no diretório
-    paths = list_files_directory(directory_path)
-    result = []
+    # Obtém a lista de caminhos dos arquivos JSON no diretório
+    json_paths = list_files_directory(directory_path, suffix=(".json", *JSON_LINES_EXTENSIONS))
+
+    if not json_paths:
+        return
 
-    # Processa cada arquivo encontrado
-    for path in paths:
-        file_name = os.path.basename(path)
-        if file_name.endswith(".json"):
-            # Lê o conteúdo do arquivo JSON
-            data = read_json_file(path) 
-            if data:  # Verifica se os dados não são None
-                result.append((file_name, data))  # Adiciona tupla com o nome do arquivo e os dados
-        else:
-            logger.warning(f"Arquivo não suportado: {file_name}")
+    max_workers = min(len(json_paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for index, path in enumerate(json_paths, start=1):
+            # Lê o conteúdo do arquivo JSON em uma thread do pool
+            pending.append((os.path.basename(path), executor.submit(read_json_file, path)))
 
-    return result
+            # Fornece os arquivos em ordem quando a janela de leitura está cheia
+            # ou quando todos os arquivos já foram submetidos
+            while pending and (len(pending) >= max_workers or index == len(json_paths)):
+                file_name, future = pending.popleft()
+                data = future.result()
+                if data:  # Verifica se os dados não são None
+                    yield file_name, data  # Fornece tupla com o nome do arquivo e os dados
 
 
-def convert_to_df(data: dict):  
+def convert_to_df(data: dict, filters=None):  
     """
-    Converte um dicionário em um DataFrame do pandas.
+    Converte um dicionário (ou uma tabela Arrow) em um DataFrame do pandas.
+    
+    Nas tabelas Arrow, colunas com datas apenas no formato ISO já chegam como
+    datetime64, enquanto o caminho do dicionário as mantém como texto;
+    convert_to_datetime aceita os dois tipos.
     
     Args:
-        data (dict): Dicionário a ser convertido em DataFrame.
+        data (dict ou pa.Table): Dicionário ou tabela Arrow a ser convertido em DataFrame.
+        filters (dict, optional): Critérios no formato coluna=valores. Registros que
+                                  não atendem aos critérios são descartados antes
+                                  da criação do DataFrame.
         
     Returns:
         pd.DataFrame: DataFrame criado a partir do dicionário.
@@ -211,12 +304,50 @@ def convert_to_df(data: dict):
         Exception: Registra erro se a conversão falhar.
     """
     try:
-        # Cria um DataFrame usando as chaves do dicionário como índices
-        df = pd.DataFrame.from_dict(data, orient='index')
-        return df
+        # Tabelas Arrow (arquivos JSON-lines) são filtradas e convertidas diretamente,
+        # indexadas pela posição do registro no arquivo (como str), no formato dos
+        # arquivos JSON brutos
+        if isinstance(data, pa.Table):
+            positions = range(data.num_rows)
+            if filters:
+                masks = [pc.is_in(data[column], value_set=pa.array(values)) for column, values in filters.items()]
+                mask = masks[0]
+                for other in masks[1:]:
+                    mask = pc.and_(mask, other)
+                data = data.filter(mask)
+                positions = pc.indices_nonzero(mask).to_pylist()
+            df = data.to_pandas(coerce_temporal_nanoseconds=True)
+            df.index = pd.Index([str(position) for position in positions])
+            return df
+
+        # Descarta na leitura os registros que não atendem aos filtros
+        if filters:
+            data = {
+                key: record for key, record in data.items()
+                if all(record.get(column) in values for column, values in filters.items())
+            }
+
+        # Cria um DataFrame usando as chaves do dicionário como índices, montando as
+        # colunas via Arrow; colunas com tipos mistos, inteiros fora do int64 ou valores
+        # aninhados (listas, objetos) seguem o caminho do pandas
+        try:
+            records = pa.array(list(data.values()))
+        except (pa.ArrowException, OverflowError, TypeError):
+            records = None
+
+        if records is None or not pa.types.is_struct(records.type) or any(
+            pa.types.is_nested(field.type) for field in records.type
+        ):
+            return pd.DataFrame.from_dict(data, orient='index')
+
+        df = pa.Table.from_struct_array(records).to_pandas()
+        df.index = pd.Index(list(data.keys()))
+        # O tipo struct inferido ordena os campos alfabeticamente; restaura a ordem
+        # em que as chaves aparecem nos registros, como em from_dict
+        return df[list(dict.fromkeys(key for record in data.values() for key in record))]
     except Exception as e:
         # Registra qualquer erro ocorrido durante a conversão
-        logger.error(f"Erro ao converter dados para DataFrame: {e}")
+        logger.error("Erro ao converter dados para DataFrame: {}", e)
 
 
 def convert_to_datetime(df: pd.DataFrame, column):
@@ -224,6 +355,9 @@ def convert_to_datetime(df: pd.DataFrame, column):
     """
     Converte uma coluna de um DataFrame para o formato datetime padrão.
     
+    Apenas os valores distintos da coluna são convertidos; o resultado é então
+    expandido para todas as linhas.
+    
     Args:
         df (pd.DataFrame): DataFrame contendo a coluna a ser convertida
         column: Nome da coluna que contém os valores de data a serem convertidos
@@ -234,52 +368,34 @@ def convert_to_datetime(df: pd.DataFrame, column):
     Raises:
         Exception: Registra erro se a conversão falhar
     """
-    try:    
-        
-        def parse_and_standardize_date(value):
-            """
-            Função interna que analisa e padroniza valores de data em formato YYYY-MM-DD.
-            Lida com diversos formatos de entrada incluindo YYYY-MM-DD, DD/MM/YYYY e outros.
-            """
-            try:
-                # Retorna None para valores vazios ou nulos
-                if pd.isna(value) or value is None or value == '':
-                    return None
-                    
-                # Verifica se já está no formato desejado (YYYY-MM-DD)
-                if isinstance(value, str) and '-' in value:
-                    parts = value.split('-')
-                    if len(parts) == 3 and len(parts[0]) == 4:
-                        return value
-                        
-                # Processa datas no formato com barras (/)
-                if isinstance(value, str) and '/' in value:
-                    parts = value.split('/')
-                    
-                    if len(parts) == 3:
-                        # Verifica se é YYYY/MM/DD (primeiro elemento tem 4 dígitos)
-                        if len(parts[0]) == 4:
-                            # Converte YYYY/MM/DD para YYYY-MM-DD
-                            return f"{parts[0]}-{parts[1]}-{parts[2]}"
-                            
-                        # Verifica se é DD/MM/YYYY (último elemento tem 4 dígitos)
-                        elif len(parts[2]) == 4:
-                            # Reorganiza DD/MM/YYYY para YYYY-MM-DD
-                            return f"{parts[2]}-{parts[1]}-{parts[0]}"
-                
-                # Para outros formatos, usa a biblioteca arrow para tentar converter
-                date_obj = arrow.get(value)
-                return date_obj.format('YYYY-MM-DD')
-                
-            except Exception as e:
-                logger.error(f"Erro ao analisar data '{value}': {e}")
-                return None
-
-        # Aplica a função de conversão em cada elemento da coluna e converte para datetime
-        result = pd.to_datetime(df[column].apply(parse_and_standardize_date)) 
-        
-        return result      
+    try:
+        # Valores distintos da coluna; valores nulos recebem o código -1
+        codes, uniques = pd.factorize(df[column])
+        values = pd.Series(uniques)
+
+        # Formato padrão (YYYY-MM-DD) convertido diretamente pelo parser do pandas
+        result = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+
+        # Formatos com barras (DD/MM/YYYY e YYYY/MM/DD) aplicados apenas aos valores restantes
+        for date_format in ['%d/%m/%Y', '%Y/%m/%d']:
+            residual = values[result.isna()]
+            if residual.empty:
+                break
+            result = result.combine_first(pd.to_datetime(residual, format=date_format, errors='coerce'))
+
+        # Para outros formatos, usa a inferência do pandas em uma única chamada
+        residual = values[result.isna()]
+        if not residual.empty:
+            result = result.combine_first(pd.to_datetime(residual, format='mixed', dayfirst=True, errors='coerce'))
+
+        # Registra valores que não puderam ser convertidos
+        invalid = values[result.isna() & (values != '')]
+        if not invalid.empty:
+            logger.error("Erro ao analisar {} datas distintas na coluna '{}': {}", len(invalid), column, invalid[:5].tolist())
+
+        # Expande os valores convertidos para todas as linhas, com NaT para os nulos
+        return pd.Series(result.array.take(codes, allow_fill=True), index=df.index, name=column)
 
     except Exception as e:
         # Registra erro se houver falha geral na conversão da coluna
-        logger.error(f"Erro ao converter colunas para datetime: {e}")
\ No newline at end of file
+        logger.error("Erro ao converter colunas para datetime: {}", e)
\ No newline at end of file